@@ -0,0 +1,29 @@
+import functools
+import os
+from pathlib import Path
+
+
+def read_tail(file_path: Path, max_chars: int) -> str:
+    """
+    Returns the last `max_chars` characters of a UTF-8 file, reading only its tail.
+    A UTF-8 character is at most 4 bytes, so 4 * max_chars bytes always cover the slice.
+    """
+    with open(file_path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - 4 * max_chars))
+        tail = f.read().decode("utf-8", errors="ignore")
+    return tail[-max_chars:]
+
+
+def locked(lock_attr: str):
+    """
+    Method decorator: runs the method while holding the instance's `lock_attr` lock.
+    Used for vault read-modify-write methods, which tools may call from several threads.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with getattr(self, lock_attr):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
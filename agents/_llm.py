@@ -0,0 +1,25 @@
+from collections.abc import Callable
+import google.generativeai as genai
+from agents._llm_cache import cached_generate_async
+
+
+class AsyncGeminiClient:
+    """
+    Shared async entry point to Gemini for the sub-agents.
+    Lets callers fan out several generations with asyncio.gather instead of
+    waiting on each blocking generate_content call in turn.
+    """
+
+    def __init__(self, model: genai.GenerativeModel):
+        self.model = model
+
+    async def generate(self, prompt: str, ttl: int = 0, validate: Callable[[str], object] | None = None) -> str:
+        """
+        Generates a completion for `prompt` and returns its text.
+        With ttl > 0 the response is served from / stored in the LLM cache
+        (only if `validate`, when given, accepts it).
+        """
+        if ttl > 0:
+            return await cached_generate_async(self.model, prompt, ttl=ttl, validate=validate)
+        response = await self.model.generate_content_async(prompt)
+        return response.text
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# Default lifetime of a cached response (seconds)
+LLM_CACHE_TTL = 3600
+
+_CACHE_DIR = Path("vault/.llm_cache") # Hidden: skipped by the vault walkers and Obsidian
+_MEMORY_MAXSIZE = 512
+_memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+# Tools call the cache from worker threads
+_memory_lock = threading.Lock()
+
+# The disk layer lives in the user's (synced) vault: drop expired files and cap its size
+_DISK_MAXFILES = 1000
+_PRUNE_INTERVAL = 600
+_last_prune = 0.0
+
+
+def _cache_key(model: genai.GenerativeModel, prompt: str) -> str:
+    """SHA-256 of (model name, system instruction, prompt)."""
+    # The SDK keeps the system instruction as a protos.Content on the model
+    system_instruction = str(getattr(model, "_system_instruction", "") or "")
+    payload = "\x00".join([model.model_name, system_instruction, prompt])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _is_deterministic(model: genai.GenerativeModel) -> bool:
+    """Models explicitly configured with temperature > 0 are not cached."""
+    generation_config = getattr(model, "_generation_config", None) or {}
+    return not generation_config.get("temperature")
+
+
+def _get(key: str) -> str | None:
+    now = time.time()
+
+    # 1. In-process LRU
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry:
+            expires_at, text = entry
+            if expires_at > now:
+                _memory.move_to_end(key)
+                return text
+            del _memory[key]
+
+    # 2. On-disk layer (survives restarts)
+    path = _CACHE_DIR / f"{key}.json"
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if data["expires_at"] <= now:
+        path.unlink(missing_ok=True)
+        return None
+    _remember(key, data["expires_at"], data["text"])
+    return data["text"]
+
+
+def _remember(key: str, expires_at: float, text: str):
+    with _memory_lock:
+        _memory[key] = (expires_at, text)
+        _memory.move_to_end(key)
+        while len(_memory) > _MEMORY_MAXSIZE:
+            _memory.popitem(last=False)
+
+
+def _prune_disk(now: float):
+    """
+    Deletes expired cache files, then the ones expiring soonest beyond _DISK_MAXFILES.
+    Most prompts embed fresh vault data, so their keys rarely repeat and an expired
+    file would otherwise never be read (and removed) again.
+    """
+    live = []
+    with os.scandir(_CACHE_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    expires_at = json.load(f)["expires_at"]
+            except (OSError, ValueError, KeyError, TypeError):
+                expires_at = 0
+            if expires_at <= now:
+                Path(entry.path).unlink(missing_ok=True)
+            else:
+                live.append((expires_at, entry.path))
+
+    excess = len(live) - _DISK_MAXFILES
+    if excess > 0:
+        for _, path in heapq.nsmallest(excess, live):
+            Path(path).unlink(missing_ok=True)
+
+
+def _set(key: str, text: str, ttl: int):
+    now = time.time()
+    expires_at = now + ttl
+    _remember(key, expires_at, text)
+    try:
+        _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        (_CACHE_DIR / f"{key}.json").write_text(
+            json.dumps({"expires_at": expires_at, "text": text}), encoding="utf-8"
+        )
+    except OSError as e:
+        logger.warning(f"Could not persist LLM cache entry: {e}")
+        return
+
+    global _last_prune
+    with _memory_lock:
+        due = now - _last_prune > _PRUNE_INTERVAL
+        if due:
+            _last_prune = now
+    if due:
+        try:
+            _prune_disk(now)
+        except OSError as e:
+            logger.warning(f"Could not prune LLM cache: {e}")
+
+
+def cached_generate(model: genai.GenerativeModel, prompt: str, ttl: int = LLM_CACHE_TTL,
+                    validate: Callable[[str], object] | None = None) -> str:
+    """
+    generate_content(prompt).text, served from cache when the same model, system
+    instruction and prompt were answered less than `ttl` seconds ago.
+    `validate` is called on a fresh response before it is stored; if it raises,
+    the exception propagates and the response is not cached.
+    """
+    if ttl <= 0 or not _is_deterministic(model):
+        return model.generate_content(prompt).text
+
+    key = _cache_key(model, prompt)
+    text = _get(key)
+    if text is None:
+        text = model.generate_content(prompt).text
+        if validate is not None:
+            validate(text)
+        if text:
+            _set(key, text, ttl)
+    return text
+
+
+async def cached_generate_async(model: genai.GenerativeModel, prompt: str, ttl: int = LLM_CACHE_TTL,
+                                validate: Callable[[str], object] | None = None) -> str:
+    """Async variant of cached_generate. Disk reads, writes and pruning run in a worker thread."""
+    if ttl <= 0 or not _is_deterministic(model):
+        return (await model.generate_content_async(prompt)).text
+
+    key = _cache_key(model, prompt)
+    text = await asyncio.to_thread(_get, key)
+    if text is None:
+        text = (await model.generate_content_async(prompt)).text
+        if validate is not None:
+            validate(text)
+        if text:
+            await asyncio.to_thread(_set, key, text, ttl)
+    return text
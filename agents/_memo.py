@@ -0,0 +1,96 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Per-namespace write generation. Writer tools bump it so memoized reads recompute.
+_generations: dict[str, int] = {}
+_lock = threading.Lock()
+# Files read by the memoized call currently running (see depends_on)
+_reads: contextvars.ContextVar[list | None] = contextvars.ContextVar("memo_reads", default=None)
+
+
+def bump(namespace: str = "vault"):
+    """Invalidates every memoized result in `namespace`."""
+    with _lock:
+        _generations[namespace] = _generations.get(namespace, 0) + 1
+
+
+def _mtime(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def depends_on(path):
+    """
+    Called inside a memoize_pure function, before reading `path` (a file, or a
+    directory for "not found" results): the cached result is dropped as soon as
+    its mtime changes, e.g. when the note is edited in Obsidian.
+    """
+    reads = _reads.get()
+    if reads is not None:
+        reads.append((os.fspath(path), _mtime(path)))
+
+
+def _record(reads: tuple):
+    """Propagates a nested memoized call's dependencies to the enclosing one."""
+    outer = _reads.get()
+    if outer is not None:
+        outer.extend(reads)
+
+
+def memoize_pure(ttl: float = 60, invalidate_on: tuple[str, ...] = (), namespace: str = "vault", maxsize: int = 128):
+    """
+    Memoizes a side-effect-free read keyed on its arguments.
+    A cached result is reused for up to `ttl` seconds, as long as no file in
+    `invalidate_on` or registered via depends_on changed (mtime) and `namespace`
+    was not bumped since.
+    """
+    def decorator(fn):
+        cache: OrderedDict = OrderedDict()
+        cache_lock = threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                key = (args, frozenset(kwargs.items()))
+                hash(key)
+            except TypeError:  # Unhashable arguments are never cached
+                return fn(*args, **kwargs)
+            mtimes = tuple(_mtime(p) for p in invalidate_on)
+            generation = _generations.get(namespace, 0)
+            now = time.monotonic()
+
+            with cache_lock:
+                entry = cache.get(key)
+                if entry and entry[1] > now and entry[2] == mtimes and entry[3] == generation:
+                    cache.move_to_end(key)
+                else:
+                    entry = None
+            if entry is not None and all(_mtime(path) == mtime for path, mtime in entry[4]):
+                _record(entry[4])
+                return entry[0]
+
+            token = _reads.set([])
+            try:
+                result = fn(*args, **kwargs)
+                reads = tuple(_reads.get())
+            finally:
+                _reads.reset(token)
+            _record(reads)
+
+            with cache_lock:
+                # Stamped with the generation seen *before* the read, so a concurrent write invalidates it
+                cache[key] = (result, now + ttl, mtimes, generation, reads)
+                cache.move_to_end(key)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return result
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
@@ -0,0 +1,11 @@
+import functools
+import google.generativeai as genai
+
+
+@functools.lru_cache(maxsize=16)
+def get_model(model_name: str, system_instruction: str) -> genai.GenerativeModel:
+    """
+    Returns a shared GenerativeModel per (model, system instruction), so re-creating
+    an agent does not rebuild the model or its underlying client state.
+    """
+    return genai.GenerativeModel(model_name=model_name, system_instruction=system_instruction)
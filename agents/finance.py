@@ -1,19 +1,77 @@
 import os
 from pathlib import Path
-from datetime import datetime
-import google.generativeai as genai
+from datetime import datetime, timedelta
+from collections import Counter
+from types import MappingProxyType
 from config import settings
+from agents._llm import AsyncGeminiClient
+from agents._models import get_model
+from agents._fileio import locked, read_tail
+from agents._llm_cache import cached_generate, LLM_CACHE_TTL
 import logging
+import asyncio
 import re
+import mmap
+import tempfile
+import threading
 
-# Configure Logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _iter_lines_reversed(f, block_size: int = 4096):
+    """
+    Yields (offset, line) pairs of a binary file from the last line to the first.
+    Reads backwards in fixed-size blocks (like `tail`), so only the end of the file is touched
+    when the caller stops early. `line` excludes the trailing newline.
+    """
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    remainder = b""
+    while pos > 0:
+        read_size = min(block_size, pos)
+        pos -= read_size
+        f.seek(pos)
+        chunk = f.read(read_size) + remainder
+        lines = chunk.split(b"\n")
+        # The first piece may be the tail of a line that starts in an earlier block
+        remainder = lines[0]
+        offset = pos + len(chunk)
+        for line in reversed(lines[1:]):
+            offset -= len(line)
+            yield offset, line
+            offset -= 1
+    yield 0, remainder
+
+# Category inference: keyword -> category, frozen at import
+_KEYWORD_TO_CATEGORY = MappingProxyType({
+    **dict.fromkeys(["uber", "taxi", "bus", "train", "gas"], "Transport"),
+    **dict.fromkeys(["food", "lunch", "dinner", "groceries", "market", "arepa"], "Food"),
+    **dict.fromkeys(["netflix", "spotify", "movie", "game"], "Entertainment"),
+    **dict.fromkeys(["salary", "freelance", "client"], "Income"),
+})
+# Decides when a description hits several categories
+_CATEGORY_PRIORITY = ("Transport", "Food", "Entertainment", "Income")
+# One pass over the description; the lookahead keeps matches overlapping like substring checks
+_KEYWORD_RE = re.compile("(?=(" + "|".join(map(re.escape, _KEYWORD_TO_CATEGORY)) + "))")
+
+_TABLE_HEADER = """| Date | Type | Category | Description | Amount | Currency |
+| :--- | :--- | :--- | :--- | :--- | :--- |
+"""
+
+# Header/metadata lines that can never be a transaction row
+_SKIP_RE = re.compile(r"\| Date|\| :---|#|---|type:|\s*$")
+
+# Audit scopes that only need recent rows, and how many days back they look
+_AUDIT_WINDOW_DAYS = {"daily_quick_check": 1, "weekly": 7}
+
 class FinanceAgent:
+    # Amount extraction for fuzzy deletes (e.g. "6000000" from "delete 6000000")
+    _NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+
     def __init__(self):
         self.vault_path = Path("vault/Finance")
         self.vault_path.mkdir(parents=True, exist_ok=True)
+        # Serializes writes to the month logs (log / delete / undo)
+        self._write_lock = threading.Lock()
         
         # CFO Persona for Audits
         self.audit_system_instruction = """
@@ -34,19 +92,89 @@ class FinanceAgent:
         "## The Numbers", "## The Verdict", "## Action Plan".
         """
         
-        self.model = genai.GenerativeModel(
-            model_name=settings.GEMINI_MODEL,
-            system_instruction=self.audit_system_instruction
-        )
+        self.model = get_model(settings.GEMINI_MODEL, self.audit_system_instruction)
+        self.llm = AsyncGeminiClient(self.model)
+        # Non-interactive flows run on the (cheaper) background model
+        self.background_model = get_model(settings.background_model, self.audit_system_instruction)
+        self.background_llm = AsyncGeminiClient(self.background_model)
 
-    def _get_current_month_file(self) -> Path:
+    def _get_current_month_file(self, now: datetime | None = None) -> Path:
         """Returns path to current month's log file, e.g., vault/Finance/2025-11-Finance.md"""
-        current_month = datetime.now().strftime("%Y-%m")
-        return self.vault_path / f"{current_month}-Finance.md"
+        return self._get_month_file(now or datetime.now())
+
+    def _get_month_file(self, when: datetime) -> Path:
+        """Returns path to the log file of the month containing `when`."""
+        return self.vault_path / f"{when.strftime('%Y-%m')}-Finance.md"
+
+    def _get_month_files(self, start: datetime, end: datetime) -> list[Path]:
+        """Monthly log paths from `start`'s month through `end`'s month, oldest first (may not exist)."""
+        files = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            files.append(self.vault_path / f"{year:04d}-{month:02d}-Finance.md")
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return files
+
+    def _tail_rows(self, file_path: Path, since: str) -> list[str]:
+        """
+        Returns the data rows dated on/after `since` (YYYY-MM-DD), oldest first.
+        Rows are appended chronologically, so the file is read backwards from EOF
+        and reading stops at the first older row.
+        """
+        rows = []
+        with open(file_path, "rb") as f:
+            for _, raw_line in _iter_lines_reversed(f):
+                line = raw_line.rstrip(b"\r").decode("utf-8", errors="replace")
+                if not line.startswith("|") or line.startswith("| :---"):
+                    continue
+                if line.startswith("| Date"):
+                    break
+                if line.split("|", 2)[1].strip()[:10] < since:
+                    break
+                rows.append(line)
+        rows.reverse()
+        return rows
+
+    def _quarterly_summary(self, files: list[Path]) -> str | None:
+        """
+        Aggregates monthly logs into per-month totals by Type/Category/Currency.
+        Missing months are skipped; returns None if none of the files exist.
+        """
+        totals = Counter()
+        counts = Counter()
+        found = False
+        for file_path in files:
+            try:
+                content = file_path.read_text(encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            found = True
+            month = file_path.name[:7]
+            for row in self._parse_markdown_table(content):
+                try:
+                    amount = float(row.get("Amount", ""))
+                except ValueError:
+                    continue
+                key = (month, row.get("Type", ""), row.get("Category", ""), row.get("Currency", ""))
+                totals[key] += amount
+                counts[key] += 1
 
-    def _ensure_file_exists(self, file_path: Path):
+        lines = ["| Month | Type | Category | Total | Currency | Transactions |",
+                 "| :--- | :--- | :--- | :--- | :--- | :--- |"]
+        for key in sorted(totals):
+            month, type_, category, currency = key
+            lines.append(f"| {month} | {type_} | {category} | {totals[key]:.2f} | {currency} | {counts[key]} |")
+        return "\n".join(lines) if found else None
+
+    def _ensure_file_exists(self, file_path: Path, now: datetime | None = None):
         """Creates the daily log file with headers if it doesn't exist."""
-        if not file_path.exists():
+        try:
+            # "x" fails if the file exists: one syscall instead of stat + open
+            f = open(file_path, "x", encoding="utf-8")
+        except FileExistsError:
+            return
+        with f:
+            now = now or datetime.now()
             header = """---
 type: finance_log
 status: active
@@ -57,8 +185,8 @@ created: {date}
 
 | Date | Type | Category | Description | Amount | Currency |
 | :--- | :--- | :--- | :--- | :--- | :--- |
-""".format(date=datetime.now().strftime("%Y-%m-%d"), month=datetime.now().strftime("%B %Y"))
-            file_path.write_text(header, encoding="utf-8")
+""".format(date=now.strftime("%Y-%m-%d"), month=now.strftime("%B %Y"))
+            f.write(header)
 
     def _parse_markdown_table(self, markdown_content: str) -> list[dict]:
         """
@@ -66,49 +194,48 @@ created: {date}
         Assumes standard format: | Header1 | Header2 | ... |
         """
         rows = []
-        lines = markdown_content.split('\n')
-        headers = []
+        headers = None
         
-        for line in lines:
+        for line in markdown_content.splitlines():
             line = line.strip()
-            if not line or not line.startswith('|'):
+            # Skip non-table lines and the separator row
+            if not line.startswith('|') or ":---" in line:
                 continue
             
+            # Split and strip in C (str.split / map) instead of per-cell Python code;
+            # [1:-1] drops the empty pieces outside the outer pipes.
+            cells = list(map(str.strip, line.split('|')[1:-1]))
+            
             # Check if it's a header row
-            if "Date" in line and not headers:
-                headers = [h.strip() for h in line.split('|') if h.strip()]
+            if headers is None:
+                if "Date" in line:
+                    headers = cells
                 continue
-                
-            # Check if it's a separator row
-            if ":---" in line:
-                continue
-                
+            
             # Data row
-            if headers:
-                values = [v.strip() for v in line.split('|') if v.strip()]
-                if len(values) == len(headers):
-                    rows.append(dict(zip(headers, values)))
+            if len(cells) == len(headers):
+                rows.append(dict(zip(headers, cells)))
                     
         return rows
 
+    @locked("_write_lock")
     def log_transaction(self, description: str, amount: float, type: str = "Expense", category: str = "General", currency: str = "USD") -> str:
         """
         Logs a financial transaction.
         If Category is 'General', tries to infer it from description.
         """
         try:
-            file_path = self._get_current_month_file()
-            self._ensure_file_exists(file_path)
+            # One timestamp for the month file and the row, so both agree at month boundaries
+            now = datetime.now()
+            file_path = self._get_current_month_file(now)
+            self._ensure_file_exists(file_path, now)
             
             # Smart Inference for Category if 'General'
             if category == "General":
-                desc_lower = description.lower()
-                if any(x in desc_lower for x in ["uber", "taxi", "bus", "train", "gas"]): category = "Transport"
-                elif any(x in desc_lower for x in ["food", "lunch", "dinner", "groceries", "market", "arepa"]): category = "Food"
-                elif any(x in desc_lower for x in ["netflix", "spotify", "movie", "game"]): category = "Entertainment"
-                elif any(x in desc_lower for x in ["salary", "freelance", "client"]): category = "Income"
+                found = {_KEYWORD_TO_CATEGORY[m.group(1)] for m in _KEYWORD_RE.finditer(description.lower())}
+                category = next((c for c in _CATEGORY_PRIORITY if c in found), category)
             
-            date_str = datetime.now().strftime("%Y-%m-%d %H:%M")
+            date_str = now.strftime("%Y-%m-%d %H:%M")
             
             # Append to markdown table
             # Standard: | Date | Type | Category | Description | Amount | Currency |
@@ -123,21 +250,40 @@ created: {date}
             logger.error(f"Error logging transaction: {e}")
             return f"Failed to log transaction: {e}"
 
-    def perform_audit(self, scope: str = "weekly") -> str:
-        """
-        Performs a financial audit based on the scope (weekly/monthly/quarterly).
-        Reads logs, parses them, and asks the CFO Brain for a report.
-        """
-        try:
-            # 1. Read Data
-            file_path = self._get_current_month_file()
-            if not file_path.exists():
-                return "No financial records found for this month to audit."
-            
-            raw_data = file_path.read_text(encoding="utf-8")
-            
-            # 2. Parse Data
-            prompt = f"""
+    def _audit_prompt(self, scope: str) -> str | None:
+        """Builds the audit prompt from the logs the scope covers. Returns None if there are none."""
+        # 1. Read Data (only what the scope needs)
+        now = datetime.now()
+        
+        window_days = _AUDIT_WINDOW_DAYS.get(scope.lower())
+        if window_days:
+            start = now - timedelta(days=window_days)
+            since = start.strftime("%Y-%m-%d")
+            rows = []
+            found = False
+            for month_file in self._get_month_files(start, now):
+                try:
+                    rows.extend(self._tail_rows(month_file, since))
+                    found = True
+                except FileNotFoundError:
+                    continue
+            if not found:
+                return None
+            raw_data = _TABLE_HEADER + "\n".join(rows)
+        elif scope.lower() == "quarterly":
+            # Pre-aggregated totals instead of three months of raw rows
+            year, month = (now.year, now.month - 2) if now.month > 2 else (now.year - 1, now.month + 10)
+            raw_data = self._quarterly_summary(self._get_month_files(now.replace(year=year, month=month, day=1), now))
+            if raw_data is None:
+                return None
+        else:
+            try:
+                raw_data = self._get_month_file(now).read_text(encoding="utf-8")
+            except FileNotFoundError:
+                return None
+        
+        # 2. Parse Data
+        return f"""
             Perform a **{scope.upper()} AUDIT** on the following financial log data.
             
             DATA:
@@ -149,61 +295,93 @@ created: {date}
             - Follow the 'AUDIT PROTOCOLS' for a {scope} review.
             - Be critical and strategic.
             """
+
+    def perform_audit(self, scope: str = "weekly") -> str:
+        """
+        Performs a financial audit based on the scope (weekly/monthly/quarterly).
+        Reads logs, parses them, and asks the CFO Brain for a report.
+        """
+        try:
+            prompt = self._audit_prompt(scope)
+            if prompt is None:
+                return "No financial records found for this month to audit."
+            
+            return cached_generate(self.background_model, prompt)
+
+        except Exception as e:
+            logger.error(f"Error performing audit: {e}")
+            return f"Failed to perform audit: {e}"
+
+    async def perform_audit_async(self, scope: str = "weekly") -> str:
+        """Async variant of perform_audit. Log reads run in a worker thread."""
+        try:
+            prompt = await asyncio.to_thread(self._audit_prompt, scope)
+            if prompt is None:
+                return "No financial records found for this month to audit."
             
-            response = self.model.generate_content(prompt)
-            return response.text
+            return await self.background_llm.generate(prompt, ttl=LLM_CACHE_TTL)
 
         except Exception as e:
             logger.error(f"Error performing audit: {e}")
             return f"Failed to perform audit: {e}"
 
+    @locked("_write_lock")
     def delete_specific_transaction(self, criteria: str) -> str:
         """
         Smart Fuzzy Deletion: Removes a transaction matching criteria (amount or text).
         Deletes the MOST RECENT match if duplicates exist.
         """
+        tmp_path = None
         try:
             file_path = self._get_current_month_file()
-            if not file_path.exists():
-                return "No transaction file found for this month."
-            
-            lines = file_path.read_text(encoding="utf-8").splitlines()
             
             # Preprocessing Criteria
             clean_criteria = criteria.lower().replace("$", "").replace(",", "").replace("usd", "").replace("cop", "").strip()
-            criteria_number = None
-            # Extract potential number from criteria (e.g. "6000000" from "delete 6000000")
+            # Find first sequence of digits/decimals
+            match = FinanceAgent._NUMBER_RE.search(clean_criteria)
+            criteria_number = match.group(0) if match else None
+
+            deleted_line = None
+
             try:
-                # Find first sequence of digits/decimals
-                match = re.search(r'\d+(\.\d+)?', clean_criteria)
-                if match:
-                    criteria_number = match.group(0)
-            except:
-                pass
-
-            match_index = -1
-
-            # Iterate to find LAST match (most recent)
-            for i, line in enumerate(lines):
-                # Skip headers/metadata
-                if line.startswith("| Date") or line.startswith("| :---") or line.strip() == "" or line.startswith("#") or line.startswith("---") or line.startswith("type:"):
-                    continue
-                
-                line_lower = line.lower()
-                
-                # Check 1: Exact Number Match
-                if criteria_number and criteria_number in line_lower:
-                    match_index = i
-                # Check 2: Text Substring Match
-                elif clean_criteria in line_lower:
-                    match_index = i
-            
-            if match_index != -1:
-                deleted_line = lines[match_index]
-                del lines[match_index]
-                
-                # Write back
-                file_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+                f = open(file_path, "rb")
+            except FileNotFoundError:
+                return "No transaction file found for this month."
+
+            with f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return f"No matching transaction found for '{criteria}'."
+
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    # Walk lines backwards in place: the first match is the most recent one
+                    end = len(mm)
+                    while end > 0:
+                        start = mm.rfind(b"\n", 0, end) + 1
+                        line = mm[start:end].rstrip(b"\r").decode("utf-8", errors="replace")
+
+                        # Skip headers/metadata
+                        if not _SKIP_RE.match(line):
+                            line_lower = line.lower()
+
+                            # Check 1: Exact Number Match / Check 2: Text Substring Match
+                            if (criteria_number and criteria_number in line_lower) or clean_criteria in line_lower:
+                                deleted_line = line
+                                break
+
+                        end = start - 1
+
+                    if deleted_line is not None:
+                        # Copy everything but the matched line (and its newline) straight from the map.
+                        # Unique temp name, so concurrent deletes never share a scratch file.
+                        fd, tmp_name = tempfile.mkstemp(dir=self.vault_path, suffix=".tmp")
+                        tmp_path = Path(tmp_name)
+                        with memoryview(mm) as view, os.fdopen(fd, "wb") as dst:
+                            dst.write(view[:start])
+                            dst.write(view[end + 1:])
+
+            if deleted_line is not None:
+                os.replace(tmp_path, file_path)
+                tmp_path = None
                 logger.info(f"Deleted transaction: {deleted_line}")
                 return f"Successfully deleted transaction: {deleted_line}"
             else:
@@ -211,26 +389,34 @@ created: {date}
 
         except Exception as e:
             logger.error(f"Error deleting transaction: {e}")
+            if tmp_path is not None:
+                tmp_path.unlink(missing_ok=True)
             return f"Failed to delete transaction: {e}"
             
+    @locked("_write_lock")
     def undo_last_transaction(self) -> str:
         """
         Removes the very last transaction logged.
         """
         try:
             file_path = self._get_current_month_file()
-            if not file_path.exists():
+            try:
+                f = open(file_path, "rb+")
+            except FileNotFoundError:
                 return "No transaction file found."
             
-            lines = file_path.read_text(encoding="utf-8").splitlines()
-            
-            # Find last data line
-            for i in range(len(lines) - 1, -1, -1):
-                line = lines[i]
-                if line.strip() and line.startswith("|") and not line.startswith("| Date") and not line.startswith("| :---"):
-                    deleted_line = lines.pop(i)
-                    file_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
-                    return f"Undid last transaction: {deleted_line}"
+            # Find last data line, reading backwards from EOF, and truncate it in place
+            with f:
+                for offset, raw_line in _iter_lines_reversed(f):
+                    line = raw_line.rstrip(b"\r").decode("utf-8", errors="replace")
+                    if line.strip() and line.startswith("|") and not line.startswith("| Date") and not line.startswith("| :---"):
+                        # Keep anything written after the row (usually nothing)
+                        f.seek(offset + len(raw_line) + 1)
+                        trailer = f.read()
+                        f.truncate(offset)
+                        f.seek(offset)
+                        f.write(trailer)
+                        return f"Undid last transaction: {line}"
             
             return "No transactions found to undo."
             
@@ -238,18 +424,16 @@ created: {date}
              logger.error(f"Error undoing transaction: {e}")
              return f"Failed to undo transaction: {e}"
 
-    def get_financial_advice(self, question: str) -> str:
-        """
-        Asks the CFO for advice without a full audit.
-        """
+    def _advice_prompt(self, question: str) -> str:
+        """Builds the advice prompt with the tail of this month's log as context."""
+        # 1. Read Data (for context)
+        file_path = self._get_current_month_file()
         try:
-            # 1. Read Data (for context)
-            file_path = self._get_current_month_file()
+            context_data = read_tail(file_path, 2000) # Last 2000 chars for context
+        except FileNotFoundError:
             context_data = ""
-            if file_path.exists():
-                context_data = file_path.read_text(encoding="utf-8")[-2000:] # Last 2000 chars for context
 
-            prompt = f"""
+        return f"""
             The user is asking for financial advice.
             
             USER QUESTION: "{question}"
@@ -262,9 +446,23 @@ created: {date}
             - Check if the request aligns with recent spending.
             - Give a YES/NO recommendation with reasoning.
             """
-            
-            response = self.model.generate_content(prompt)
-            return response.text
+
+    def get_financial_advice(self, question: str) -> str:
+        """
+        Asks the CFO for advice without a full audit.
+        """
+        try:
+            return cached_generate(self.model, self._advice_prompt(question))
+
+        except Exception as e:
+            logger.error(f"Error getting financial advice: {e}")
+            return f"Failed to get advice: {e}"
+
+    async def get_financial_advice_async(self, question: str) -> str:
+        """Async variant of get_financial_advice. Log reads run in a worker thread."""
+        try:
+            prompt = await asyncio.to_thread(self._advice_prompt, question)
+            return await self.llm.generate(prompt, ttl=LLM_CACHE_TTL)
 
         except Exception as e:
             logger.error(f"Error getting financial advice: {e}")
@@ -1,21 +1,33 @@
 import os
 from pathlib import Path
-import google.generativeai as genai
 from config import settings
+from agents._llm import AsyncGeminiClient
+from agents._models import get_model
+from agents._fileio import locked, read_tail
+from agents._llm_cache import cached_generate, LLM_CACHE_TTL
 import logging
+import asyncio
 from datetime import datetime
 import json
+import orjson
+import re
+import threading
 
-# Configure Logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_DONE_STATUSES = {"done", "completed", "yes", "new project started"}
+# Tracker lines that are not habit rows: non-table lines, the header and the separator
+_SKIP_RE = re.compile(r"(?!\|)|\| :---|\| Date")
+
 class GoalsAgent:
     def __init__(self):
         self.goals_path = Path("vault/Goals")
         self.goals_path.mkdir(parents=True, exist_ok=True)
         self.tracker_file = self.goals_path / "Habit-Tracker.md"
         self.vision_file = self.goals_path / "5-Year-Plan.md"
+        self.streaks_file = self.goals_path / ".streaks.json"
+        # Serializes tracker rewrites and the shared streak state
+        self._write_lock = threading.Lock()
         
         # Coach Persona
         self.coach_instruction = """
@@ -24,12 +36,53 @@ class GoalsAgent:
         STYLE: Direct, no excuses, use emojis 🔥 🚀.
         """
         
-        self.model = genai.GenerativeModel(
-            model_name=settings.GEMINI_MODEL,
-            system_instruction=self.coach_instruction
-        )
+        self.model = get_model(settings.GEMINI_MODEL, self.coach_instruction)
+        self.llm = AsyncGeminiClient(self.model)
+        # Non-interactive flows run on the (cheaper) background model
+        self.background_model = get_model(settings.background_model, self.coach_instruction)
+        self.background_llm = AsyncGeminiClient(self.background_model)
         
         self._ensure_tracker_exists()
+        self._load_streaks()
+
+    def _load_streaks(self):
+        """
+        Loads {habit: (last_date, streak, streak_before_last)} from the .streaks.json sidecar.
+        streak_before_last is the streak before the last row, so re-logging today can
+        replace that row's contribution. Falls back to
+        a single pass over the tracker if the sidecar is missing or the tracker changed
+        outside this agent (e.g. edited in Obsidian).
+        """
+        self._tracker_mtime = self.tracker_file.stat().st_mtime
+        try:
+            data = json.loads(self.streaks_file.read_text(encoding="utf-8"))
+            if data["tracker_mtime"] == self._tracker_mtime:
+                self._streaks = {
+                    habit: (last_date, streak, before)
+                    for habit, (last_date, streak, before) in data["streaks"].items()
+                }
+                return
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        self._rebuild_streaks()
+
+    def _rebuild_streaks(self):
+        """One pass over the tracker counting each habit's current streak of done rows."""
+        self._streaks = {}
+        for line in self.tracker_file.read_text(encoding="utf-8").splitlines():
+            if _SKIP_RE.match(line):
+                continue
+            parts = [p.strip() for p in line.split("|") if p.strip()]
+            if len(parts) < 3:
+                continue
+            date, habit, status = parts[0], parts[1], parts[2]
+            _, streak, _ = self._streaks.get(habit, (None, 0, 0))
+            self._streaks[habit] = (date, streak + 1 if status.lower() in _DONE_STATUSES else 0, streak)
+        self._save_streaks()
+
+    def _save_streaks(self):
+        data = {"tracker_mtime": self._tracker_mtime, "streaks": self._streaks}
+        self.streaks_file.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
 
     def _ensure_tracker_exists(self):
         if not self.tracker_file.exists():
@@ -40,24 +93,25 @@ class GoalsAgent:
 """
             self.tracker_file.write_text(content, encoding="utf-8")
 
+    @locked("_write_lock")
     def log_habit(self, habit: str, status: str) -> str:
         """
         Logs a habit status (Done/Missed).
         """
         try:
             date_str = datetime.now().strftime("%Y-%m-%d")
-            
-            # Analyze Streak (Simple logic)
-            content = self.tracker_file.read_text(encoding="utf-8")
-            streak = 0
-            if status.lower() in ["done", "completed", "yes", "new project started"]:
-                # Check previous lines for same habit
-                lines = content.split('\n')
-                for line in reversed(lines):
-                    if habit in line and ("Done" in line or "Yes" in line or "New Project" in line):
-                        streak += 1
-                    elif habit in line:
-                        break # Streak broken
+
+            # Recount if the tracker was edited outside this agent (e.g. in Obsidian)
+            if self.tracker_file.stat().st_mtime != self._tracker_mtime:
+                self._rebuild_streaks()
+
+            # Analyze Streak (O(1): read from the incremental counter, no file scan).
+            # Re-logging today replaces today's row, so count from the streak before it.
+            last_date, streak, before_last = self._streaks.get(habit, (None, 0, 0))
+            rewrite_today = last_date == date_str
+            base = before_last if rewrite_today else streak
+            done = status.lower() in _DONE_STATUSES
+            streak = base if done else 0
             
             comment = ""
             if streak > 2:
@@ -69,24 +123,28 @@ class GoalsAgent:
 
             new_row = f"| {date_str} | {habit} | {status} | {comment} |"
 
-            lines = content.splitlines()
-            updated = False
-
-            for idx, line in enumerate(lines):
-                if not line.startswith("|") or line.startswith("| :---") or "Date" in line:
-                    continue
-                parts = [p.strip() for p in line.split("|") if p.strip()]
-                if len(parts) >= 4 and parts[0] == date_str and parts[1] == habit:
-                    lines[idx] = new_row
-                    updated = True
-                    break
-
-            if not updated:
-                if lines and lines[-1].strip() != "":
-                    lines.append("")
-                lines.append(new_row)
+            if rewrite_today:
+                # Same habit already logged today: rewrite its last row in place
+                lines = self.tracker_file.read_text(encoding="utf-8").splitlines()
+                for idx in range(len(lines) - 1, -1, -1):
+                    if _SKIP_RE.match(lines[idx]):
+                        continue
+                    parts = [p.strip() for p in lines[idx].split("|") if p.strip()]
+                    # Same row criteria as _rebuild_streaks (the comment cell may be empty)
+                    if len(parts) >= 3 and parts[0] == date_str and parts[1] == habit:
+                        lines[idx] = new_row
+                        break
+                else:
+                    lines.extend(["", new_row])
+                self.tracker_file.write_text("\n".join(lines).rstrip() + "\n", encoding="utf-8")
+            else:
+                # Append (blank line + row, same layout as before) without reading the file
+                with open(self.tracker_file, "a", encoding="utf-8") as f:
+                    f.write(f"\n{new_row}\n")
+            self._streaks[habit] = (date_str, base + 1 if done else 0, base)
 
-            self.tracker_file.write_text("\n".join(lines).strip() + "\n", encoding="utf-8")
+            self._tracker_mtime = self.tracker_file.stat().st_mtime
+            self._save_streaks()
                 
             return f"Habit '{habit}' logged as {status}. {comment}"
         
@@ -94,17 +152,15 @@ class GoalsAgent:
             logger.error(f"Error logging habit: {e}")
             return f"Failed to log habit: {e}"
 
-    def morning_briefing(self) -> str:
-        """
-        Generates a morning briefing based on habits and streaks.
-        """
+    def _briefing_prompt(self) -> str:
+        """Builds the morning briefing prompt from the tail of the habit tracker."""
+        # Get Habits context
         try:
-            # Get Habits context
+            tracker_content = read_tail(self.tracker_file, 500) # Last 500 chars
+        except FileNotFoundError:
             tracker_content = ""
-            if self.tracker_file.exists():
-                tracker_content = self.tracker_file.read_text(encoding="utf-8")[-500:] # Last 500 chars
-            
-            prompt = f"""
+        
+        return f"""
             Generate a Morning Briefing for the user.
             
             CONTEXT (Recent Habits):
@@ -121,21 +177,30 @@ class GoalsAgent:
             Motivation: [Quote]
             Focus: [Top Habit to crush today]
             """
-            
-            response = self.model.generate_content(prompt)
-            return response.text
+
+    def morning_briefing(self) -> str:
+        """
+        Generates a morning briefing based on habits and streaks.
+        """
+        try:
+            return cached_generate(self.background_model, self._briefing_prompt())
 
         except Exception as e:
             logger.error(f"Error generating briefing: {e}")
             return "Go get them today. No excuses."
 
-    def analyze_project_for_habits(self, project_content: str) -> str:
-        """
-        Suggests 3 daily habits required to achieve the project.
-        Returns a JSON-like string with habits and a flag to generate tasks.
-        """
+    async def morning_briefing_async(self) -> str:
+        """Async variant of morning_briefing. Tracker reads run in a worker thread."""
         try:
-            prompt = f"""
+            prompt = await asyncio.to_thread(self._briefing_prompt)
+            return await self.background_llm.generate(prompt, ttl=LLM_CACHE_TTL)
+
+        except Exception as e:
+            logger.error(f"Error generating briefing: {e}")
+            return "Go get them today. No excuses."
+
+    def _habits_prompt(self, project_content: str) -> str:
+        return f"""
             Based on this Project Plan, suggest 3 daily habits required to achieve it.
             
             PROJECT PLAN:
@@ -147,34 +212,55 @@ class GoalsAgent:
                 "generate_tasks": true
             }}
             """
+
+    def _parse_habits(self, raw: str) -> dict:
+        """Parses and validates the model's habits JSON (tolerates ```json fences)."""
+        raw = raw.strip().strip("`").strip()
+        if raw.lower().startswith("json"):
+            raw = raw[4:]
+        data = orjson.loads(raw)
+        if not isinstance(data, dict) or "habits" not in data or "generate_tasks" not in data:
+            raise ValueError(f"Unexpected habits payload: {raw[:200]}")
+        return data
+
+    def analyze_project_for_habits(self, project_content: str) -> dict:
+        """
+        Suggests 3 daily habits required to achieve the project.
+        Returns a dict with habits and a flag to generate tasks.
+        """
+        try:
+            # Validated before caching, so a malformed reply isn't replayed for the whole TTL
+            raw = cached_generate(self.model, self._habits_prompt(project_content), validate=self._parse_habits)
+            return self._parse_habits(raw)
             
-            response = self.model.generate_content(prompt)
-            return response.text
+        except Exception as e:
+            logger.error(f"Error analyzing project for habits: {e}")
+            return {"habits": [], "generate_tasks": False, "error": "Failed to analyze project for habits."}
+
+    async def analyze_project_for_habits_async(self, project_content: str) -> dict:
+        """Async variant of analyze_project_for_habits."""
+        try:
+            raw = await self.llm.generate(self._habits_prompt(project_content), ttl=LLM_CACHE_TTL, validate=self._parse_habits)
+            return self._parse_habits(raw)
             
         except Exception as e:
             logger.error(f"Error analyzing project for habits: {e}")
-            return "Failed to analyze project for habits."
+            return {"habits": [], "generate_tasks": False, "error": "Failed to analyze project for habits."}
 
     def get_long_term_vision(self) -> str:
         """
         Reads the 5-Year Plan.
         """
         try:
-            if self.vision_file.exists():
-                return self.vision_file.read_text(encoding="utf-8")
+            return self.vision_file.read_text(encoding="utf-8")
+        except FileNotFoundError:
             return "No 5-Year Plan found. Please create one."
         except Exception as e:
             logger.error(f"Error reading vision: {e}")
             return f"Failed to read vision: {e}"
 
-    def create_vision(self, content: str) -> str:
-        """
-        Creates or overwrites the 5-Year Vision plan.
-        Expands brief input into a structured manifesto.
-        """
-        try:
-            # Expand the vision using Internal Gemini
-            prompt = f"""
+    def _vision_prompt(self, content: str) -> str:
+        return f"""
             Expand this vision statement into a structured 5-Year Manifesto.
             
             USER INPUT: "{content}"
@@ -187,18 +273,35 @@ class GoalsAgent:
             
             TONE: Inspiring, ambitious, present tense (e.g., "I am...", "I have...").
             """
-            
-            response = self.model.generate_content(prompt)
-            expanded_vision = response.text
-            
-            file_content = f"""# 5-Year Vision Manifesto 🚀
+
+    def _save_vision(self, expanded_vision: str) -> str:
+        file_content = f"""# 5-Year Vision Manifesto 🚀
 
 {expanded_vision}
 
 *Created: {datetime.now().strftime("%Y-%m-%d")}*
 """
-            self.vision_file.write_text(file_content, encoding="utf-8")
-            return "Vision Manifesto created and expanded successfully. Check the vault!"
+        self.vision_file.write_text(file_content, encoding="utf-8")
+        return "Vision Manifesto created and expanded successfully. Check the vault!"
+
+    def create_vision(self, content: str) -> str:
+        """
+        Creates or overwrites the 5-Year Vision plan.
+        Expands brief input into a structured manifesto.
+        """
+        try:
+            # Expand the vision using Internal Gemini
+            response = self.model.generate_content(self._vision_prompt(content))
+            return self._save_vision(response.text)
+        except Exception as e:
+            logger.error(f"Error creating vision: {e}")
+            return f"Failed to create vision: {e}"
+
+    async def create_vision_async(self, content: str) -> str:
+        """Async variant of create_vision. The file write runs in a worker thread."""
+        try:
+            expanded_vision = await self.llm.generate(self._vision_prompt(content))
+            return await asyncio.to_thread(self._save_vision, expanded_vision)
         except Exception as e:
             logger.error(f"Error creating vision: {e}")
             return f"Failed to create vision: {e}"
@@ -1,21 +1,109 @@
 import os
 from pathlib import Path
-import google.generativeai as genai
 from config import settings
+from agents._llm import AsyncGeminiClient
+from agents._models import get_model
+from agents._llm_cache import cached_generate, LLM_CACHE_TTL
 import logging
+import asyncio
+import atexit
+import json
+import re
+import threading
+import time
 from datetime import datetime
 
-# Configure Logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_TOKEN_RE = re.compile(r"\w+")
+# Anything but letters, digits and spaces (\w minus "_", so accented letters survive)
+_UNSAFE_FILENAME_RE = re.compile(r"[^\w ]|_")
+_SEARCH_CHUNK_SIZE = 64 * 1024
+# The index is written at most this often (seconds), plus once at shutdown
+_INDEX_PERSIST_INTERVAL = 300
+
+# Smart note template, pre-encoded once
+_NOTE_FM_PREFIX = b"---\ntype: note\ncreated: "
+_NOTE_FM_SUFFIX = b"\ntags: []\n---\n\n# "
+_NOTE_CONTEXT_HEADER = "\n\n## Librarian's Context 🧠\n".encode("utf-8")
+
+def _iter_markdown_files(root: Path):
+    """
+    Walks the vault with os.scandir (no Path objects per entry), yielding
+    DirEntry objects for .md files. Skips hidden entries and internal system files.
+    """
+    stack = [str(root)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith(".") or "Internal" in entry.path:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".md") and entry.is_file():
+                    yield entry
+
+def _find_snippet(path: str, query: str) -> str | None:
+    """
+    Returns a ~150 char snippet around the first case-insensitive match of `query`
+    in the file, or None. ASCII queries are matched on raw bytes in 64 KB chunks,
+    so files without a match are never decoded.
+    """
+    query_lower = query.lower()
+    query_bytes = query_lower.encode("utf-8")
+
+    if not query_bytes.isascii():
+        # bytes.lower() only folds ASCII; fall back to a decoded search
+        content = Path(path).read_text(encoding="utf-8", errors="ignore")
+        idx = content.lower().find(query_lower)
+        if idx == -1:
+            return None
+        return content[max(0, idx - 50):idx + 100].replace("\n", " ")
+
+    overlap = len(query_bytes) - 1
+    with open(path, "rb") as f:
+        offset = 0 # File offset of `window`
+        window = b""
+        while chunk := f.read(_SEARCH_CHUNK_SIZE):
+            window += chunk
+            idx = window.lower().find(query_bytes)
+            if idx != -1:
+                # Decode only the region around the match
+                start = max(0, offset + idx - 200)
+                f.seek(start)
+                region = f.read(600).decode("utf-8", errors="ignore")
+                idx = max(0, region.lower().find(query_lower))
+                return region[max(0, idx - 50):idx + 100].replace("\n", " ")
+            # Keep enough of the tail to catch matches spanning two chunks
+            keep = window[-overlap:] if overlap > 0 else b""
+            offset += len(window) - len(keep)
+            window = keep
+    return None
+
 class KnowledgeAgent:
     def __init__(self):
+        self.vault_root = Path("vault")
         self.notes_path = Path("vault/Notes")
         self.university_path = Path("vault/University")
         self.notes_path.mkdir(parents=True, exist_ok=True)
         self.university_path.mkdir(parents=True, exist_ok=True)
 
+        # Search Index: {path: {"mtime": float, "tokens": [...]}}, persisted between runs
+        self.index_file = Path("vault/Internal/SearchIndex.json")
+        self._index = self._load_index()
+        # Guards _index/_postings: concurrent searches refresh and read them
+        self._index_lock = threading.Lock()
+        self._postings = {}
+        self._rebuild_postings()
+        self._index_dirty = False
+        self._index_saved_at = time.monotonic()
+        self._refresh_index()
+        atexit.register(self.save_index)
+
         # Librarian Persona
         self.librarian_instruction = """
         ROLE: You are the Head Librarian of the User's Second Brain. You are academic, rigorous, and obsessed with connecting ideas.
@@ -23,22 +111,110 @@ class KnowledgeAgent:
         OUTPUT: Structured, enriched content.
         """
         
-        self.model = genai.GenerativeModel(
-            model_name=settings.GEMINI_MODEL,
-            system_instruction=self.librarian_instruction
-        )
+        self.model = get_model(settings.GEMINI_MODEL, self.librarian_instruction)
+        self.llm = AsyncGeminiClient(self.model)
+        # Non-interactive flows run on the (cheaper) background model
+        self.background_model = get_model(settings.background_model, self.librarian_instruction)
+        self.background_llm = AsyncGeminiClient(self.background_model)
 
-    def save_smart_note(self, title: str, content: str) -> str:
+    def _load_index(self) -> dict:
+        """Loads the persisted search index, or starts empty if missing/corrupt."""
+        try:
+            return json.loads(self.index_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _rebuild_postings(self):
+        """Builds the in-memory inverted index (token -> set of paths) from self._index."""
+        self._postings = {}
+        for path, entry in self._index.items():
+            for token in entry["tokens"]:
+                self._postings.setdefault(token, set()).add(path)
+
+    def _unpost(self, path: str):
+        """Removes a file's tokens from the postings."""
+        for token in self._index[path]["tokens"]:
+            paths = self._postings.get(token)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._postings[token]
+
+    def _refresh_index(self):
         """
-        Saves a note with AI-generated tags and links.
+        Re-indexes only the vault files whose mtime changed since the last run and
+        drops deleted ones, updating just their postings. The index is persisted
+        lazily (see save_index), since the finance log and habit tracker change often.
         """
-        try:
-            # Sanitize filename
-            safe_title = "".join([c for c in title if c.isalpha() or c.isdigit() or c==' ']).rstrip()
-            file_path = self.notes_path / f"{safe_title}.md"
-            
-            # AI Enrichment
-            prompt = f"""
+        seen = set()
+        for dir_entry in _iter_markdown_files(self.vault_root):
+            path = dir_entry.path
+            seen.add(path)
+            mtime = dir_entry.stat().st_mtime
+            entry = self._index.get(path)
+            if entry and entry["mtime"] == mtime:
+                continue
+
+            if entry:
+                self._unpost(path)
+            content = Path(path).read_text(encoding="utf-8", errors="ignore")
+            tokens = sorted(set(_TOKEN_RE.findall(content.lower())))
+            self._index[path] = {"mtime": mtime, "tokens": tokens}
+            for token in tokens:
+                self._postings.setdefault(token, set()).add(path)
+            self._index_dirty = True
+
+        for path in [p for p in self._index if p not in seen]:
+            self._unpost(path)
+            del self._index[path]
+            self._index_dirty = True
+
+        if self._index_dirty and time.monotonic() - self._index_saved_at > _INDEX_PERSIST_INTERVAL:
+            self._save_index()
+
+    def _save_index(self):
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        self.index_file.write_text(json.dumps(self._index), encoding="utf-8")
+        self._index_dirty = False
+        self._index_saved_at = time.monotonic()
+
+    def save_index(self):
+        """Persists the search index if it changed since the last write. Called on shutdown and at exit."""
+        with self._index_lock:
+            if self._index_dirty:
+                try:
+                    self._save_index()
+                except OSError as e:
+                    logger.warning(f"Could not persist search index: {e}")
+
+    def _candidate_files(self, query: str) -> list[str]:
+        """
+        Narrows the search to files that contain every word of the query.
+        A word that is an indexed token is a single dict lookup; otherwise it is
+        matched as a substring of the indexed tokens, so partial words (e.g. "pyth")
+        still hit, like the plain substring search.
+        """
+        query_tokens = _TOKEN_RE.findall(query.lower())
+        if not query_tokens:
+            return list(self._index)
+
+        candidates = None
+        for query_token in query_tokens:
+            paths = self._postings.get(query_token)
+            if paths is None:
+                paths = set()
+                for token, token_paths in self._postings.items():
+                    if query_token in token:
+                        paths |= token_paths
+            candidates = paths if candidates is None else candidates & paths
+            if not candidates:
+                return []
+
+        # Preserve vault walk order
+        return [p for p in self._index if p in candidates]
+
+    def _note_prompt(self, content: str) -> str:
+        return f"""
             Analyze this content for a smart note.
             CONTENT: {content}
             
@@ -52,37 +228,47 @@ class KnowledgeAgent:
             Tags: #tag1 #tag2
             Links: [[Link1]], [[Link2]]
             """
-            
-            response = self.model.generate_content(prompt)
-            enrichment = response.text
-            
-            # Construct File
-            file_content = f"""---
-type: note
-created: {datetime.now().strftime("%Y-%m-%d")}
-tags: []
----
-
-# {title}
 
-{content}
+    def _write_note(self, title: str, content: str, enrichment: str) -> str:
+        # Sanitize filename
+        safe_title = _UNSAFE_FILENAME_RE.sub("", title).rstrip()
+        file_path = self.notes_path / f"{safe_title}.md"
+        
+        # Construct File (constant template pieces are already bytes)
+        with open(file_path, "wb") as f:
+            f.writelines([
+                _NOTE_FM_PREFIX, datetime.now().strftime("%Y-%m-%d").encode("utf-8"),
+                _NOTE_FM_SUFFIX, title.encode("utf-8"), b"\n\n",
+                content.encode("utf-8"),
+                _NOTE_CONTEXT_HEADER, enrichment.encode("utf-8"), b"\n",
+            ])
+        return f"Note '{title}' saved. Enriched with metadata."
 
-## Librarian's Context 🧠
-{enrichment}
-"""
-            file_path.write_text(file_content, encoding="utf-8")
-            return f"Note '{title}' saved. Enriched with metadata."
+    def save_smart_note(self, title: str, content: str) -> str:
+        """
+        Saves a note with AI-generated tags and links.
+        """
+        try:
+            # AI Enrichment
+            response = self.model.generate_content(self._note_prompt(content))
+            return self._write_note(title, content, response.text)
 
         except Exception as e:
             logger.error(f"Error saving smart note: {e}")
             return f"Failed to save note: {e}"
 
-    def research_topic(self, topic: str) -> str:
-        """
-        Generates an academic summary of a topic using internal knowledge.
-        """
+    async def save_smart_note_async(self, title: str, content: str) -> str:
+        """Async variant of save_smart_note. The file write runs in a worker thread."""
         try:
-            prompt = f"""
+            enrichment = await self.llm.generate(self._note_prompt(content))
+            return await asyncio.to_thread(self._write_note, title, content, enrichment)
+
+        except Exception as e:
+            logger.error(f"Error saving smart note: {e}")
+            return f"Failed to save note: {e}"
+
+    def _research_prompt(self, topic: str) -> str:
+        return f"""
             Conduct a mini-research session on: '{topic}'.
             Provide a structured academic summary including:
             - Key Definitions
@@ -90,8 +276,21 @@ tags: []
             - Main Arguments/Theories
             - Critical Analysis
             """
-            response = self.model.generate_content(prompt)
-            return response.text
+
+    def research_topic(self, topic: str) -> str:
+        """
+        Generates an academic summary of a topic using internal knowledge.
+        """
+        try:
+            return cached_generate(self.background_model, self._research_prompt(topic))
+        except Exception as e:
+            logger.error(f"Error researching topic: {e}")
+            return f"Failed to research topic: {e}"
+
+    async def research_topic_async(self, topic: str) -> str:
+        """Async variant of research_topic."""
+        try:
+            return await self.background_llm.generate(self._research_prompt(topic), ttl=LLM_CACHE_TTL)
         except Exception as e:
             logger.error(f"Error researching topic: {e}")
             return f"Failed to research topic: {e}"
@@ -102,19 +301,15 @@ tags: []
         """
         try:
             matches = []
-            # Iterate through all MD files in vault
-            vault_root = Path("vault")
-            for file_path in vault_root.rglob("*.md"):
-                if "Internal" in str(file_path): continue # Skip internal system files
-                
-                content = file_path.read_text(encoding="utf-8", errors="ignore")
-                if query.lower() in content.lower():
-                    # Extract a snippet
-                    idx = content.lower().find(query.lower())
-                    start = max(0, idx - 50)
-                    end = min(len(content), idx + 100)
-                    snippet = content[start:end].replace("\n", " ")
-                    matches.append(f"- **{file_path.name}**: ...{snippet}...")
+            with self._index_lock:
+                self._refresh_index()
+                # Only open the files the index says can match
+                candidates = self._candidate_files(query)
+
+            for path in candidates:
+                snippet = _find_snippet(path, query)
+                if snippet is not None:
+                    matches.append(f"- **{os.path.basename(path)}**: ...{snippet}...")
             
             if not matches:
                 return f"No matches found for '{query}' in the Vault."
@@ -125,12 +320,8 @@ tags: []
             logger.error(f"Error searching vault: {e}")
             return f"Failed to search vault: {e}"
 
-    def create_study_plan(self, topic_or_project: str) -> str:
-        """
-        Creates a learning path/syllabus for a topic or project.
-        """
-        try:
-            prompt = f"""
+    def _study_plan_prompt(self, topic_or_project: str) -> str:
+        return f"""
             Create a learning path/syllabus for: {topic_or_project}.
             
             INSTRUCTIONS:
@@ -138,9 +329,22 @@ tags: []
             - Suggest specific search terms for each level.
             - Suggest a structure for taking notes (e.g., specific sub-topics).
             """
+
+    def create_study_plan(self, topic_or_project: str) -> str:
+        """
+        Creates a learning path/syllabus for a topic or project.
+        """
+        try:
+            return cached_generate(self.background_model, self._study_plan_prompt(topic_or_project))
             
-            response = self.model.generate_content(prompt)
-            return response.text
+        except Exception as e:
+            logger.error(f"Error creating study plan: {e}")
+            return f"Failed to create study plan: {e}"
+
+    async def create_study_plan_async(self, topic_or_project: str) -> str:
+        """Async variant of create_study_plan."""
+        try:
+            return await self.background_llm.generate(self._study_plan_prompt(topic_or_project), ttl=LLM_CACHE_TTL)
             
         except Exception as e:
             logger.error(f"Error creating study plan: {e}")
@@ -1,18 +1,126 @@
+import asyncio
+import atexit
 import logging
+import threading
 import os
-import requests
-import uuid
+import time
+import functools
+import hashlib
+import json
+import re
+import httpx
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Mapping
+from types import MappingProxyType
 from pathlib import Path
+from datetime import datetime, timedelta
 import google.generativeai as genai
-from google.generativeai import protos
+from google.generativeai import caching, protos
 from config import settings
 from agents.finance import FinanceAgent
 from agents.projects import ProjectsAgent
 from agents.knowledge import KnowledgeAgent
 from agents.goals import GoalsAgent
+from agents._models import get_model
+from agents._memo import bump, depends_on, memoize_pure
+from agents._llm_cache import _CACHE_DIR as _LLM_CACHE_DIR
+from agents._fileio import locked
 
 logger = logging.getLogger(__name__)
 
+_PROMPTS_DIR = Path(__file__).with_name("prompts")
+
+@functools.lru_cache(maxsize=1)
+def _load_system_instruction() -> str:
+    """Reads the orchestrator's system prompt from agents/prompts/system.md."""
+    return (_PROMPTS_DIR / "system.md").read_text(encoding="utf-8")
+
+SYSTEM_INSTRUCTION = _load_system_instruction()
+
+def _load_tool_declarations() -> list[protos.FunctionDeclaration]:
+    """
+    Builds the tool schemas once from agents/prompts/tools.json, instead of letting
+    the SDK introspect every bound method's signature and docstring.
+    """
+    decls = json.loads((_PROMPTS_DIR / "tools.json").read_text(encoding="utf-8"))
+    return [genai.types.FunctionDeclaration(**decl).to_proto() for decl in decls]
+
+_TOOL_DECLS = _load_tool_declarations()
+
+# Chat histories persisted per sender, so restarts don't reset conversations
+_SESSIONS_DIR = Path("vault/.sessions") # Hidden: skipped by the vault walkers and Obsidian
+_MEDIA_PLACEHOLDER = {"text": "[Media attachment]"}
+
+# App state rewritten on every turn; walking it would invalidate the read_file index each time
+_NON_NOTE_DIRS = frozenset(os.fspath(d) for d in (_SESSIONS_DIR, _LLM_CACHE_DIR))
+
+def _session_path(sender: str) -> Path:
+    return _SESSIONS_DIR / f"{hashlib.sha256(sender.encode('utf-8')).hexdigest()}.json"
+
+def _serialize_history(chat: genai.ChatSession) -> str:
+    """
+    JSON-encodes the chat history. Uploaded media (file_data/inline_data) is replaced
+    by a text placeholder, since Gemini file URIs expire and blobs would bloat the file.
+    """
+    history = []
+    for content in chat.history:
+        data = protos.Content.to_dict(content)
+        data["parts"] = [
+            _MEDIA_PLACEHOLDER if "file_data" in part or "inline_data" in part else part
+            for part in data.get("parts", [])
+        ]
+        history.append(data)
+    return json.dumps(history, ensure_ascii=False)
+
+_NAME_RE = re.compile(r"^Assistant Name:\s*(.+)$", re.M)
+
+# Blocking Gemini SDK calls (uploads, cache creation, sync tools that call the model)
+# get their own pool, so they can't starve the default executor used for file I/O
+_GEMINI_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="gemini")
+
+async def _run_blocking(func, /, *args, **kwargs):
+    """Runs a blocking Gemini-bound call on _GEMINI_EXECUTOR."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_GEMINI_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+# Uploaded media is reused for this long (Gemini deletes uploaded files after 48h)
+MEDIA_CACHE_TTL = 47 * 3600
+
+# Lifetime of the Gemini context cache holding system instruction, tools and profile
+CONTEXT_CACHE_TTL = timedelta(hours=1)
+# Rebuild the context cache this many seconds before it expires
+CONTEXT_CACHE_REFRESH_MARGIN = 300
+# A superseded context cache is deleted this many seconds later, once in-flight turns are done
+CONTEXT_CACHE_GRACE = 120
+
+# Tools that only read the vault; any other tool call invalidates memoized reads
+_PURE_TOOLS = frozenset({
+    "perform_audit", "get_financial_advice", "review_inbox", "get_project_plan",
+    "research_topic", "search_vault", "create_study_plan", "get_vision",
+    "analyze_project_for_habits", "read_file", "generate_morning_briefing",
+})
+
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+def _to_pyargs(args: Mapping) -> Mapping:
+    """
+    Returns function-call args ready for ** unpacking. The proto MapComposite is
+    already a Mapping, so it is only copied when a value is a nested Struct/ListValue
+    (MapComposite/RepeatedComposite), which tools expect as plain dicts/lists.
+    """
+    if all(isinstance(v, _SCALAR_TYPES) for v in args.values()):
+        return args
+    return {k: _to_python(v) for k, v in args.items()}
+
+def _to_python(value):
+    if isinstance(value, _SCALAR_TYPES):
+        return value
+    if isinstance(value, Mapping):
+        return {k: _to_python(v) for k, v in value.items()}
+    return [_to_python(v) for v in value]
+
 class OrchestratorAgent:
     def __init__(self):
         # Initialize Sub-Agents
@@ -56,6 +164,8 @@ class OrchestratorAgent:
             "generate_morning_briefing": self.generate_morning_briefing,
             "set_assistant_name": self.set_assistant_name
         }
+        # Read-only name -> handler view used for dispatch
+        self._tools_by_name = MappingProxyType(self.available_tools)
 
         # Configure Gemini
         # SAFETY: UNLEASHED (BLOCK_NONE)
@@ -67,90 +177,182 @@ class OrchestratorAgent:
             HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
         }
 
-        system_instruction = """
-### 🌐 LANGUAGE PROTOCOL (ABSOLUTE PRIORITY) ###
-
-1. **DETECT** the user's language.
-2. **REPLY IN THAT EXACT SAME LANGUAGE.**
-
-### 🧬 INITIALIZATION PROTOCOL ###
-
-1. **CHECK IDENTITY:** Do you have a name yet? (Check context/tools).
-   - IF NO NAME: You are a generic "Advanced AI Agent". Your ONLY goal is to ask the user to give you a name.
-   - Phrase: "System Online. Identity pending. What would you like to call me?" (In user's language).
-   - When user gives a name, CALL `set_assistant_name`.
-
-2. **CHECK USER:** Once named, do you know the User? (Check `UserProfile.md` context).
-   - IF NO USER PROFILE: Ask the user for a brief introduction to build the Core Memory.
-   - When user replies, CALL `remember_fact`.
-
-3. **OPERATIONAL MODE:** ONLY after Steps 1 & 2 are complete:
-   - You are [Assistant Name], the User's Chief of Staff.
-   - Vibe: Professional, Witty, Efficient.
-   - Manage Finance, Projects, Goals, Knowledge.
-
-### ⚡ PROACTIVE EXECUTION PROTOCOL (CRITICAL) ###
-
-1. **NEVER ASK** for information you can find yourself.
-   - If user mentions a project, **IMMEDIATELY call `get_project_plan`** to read it.
-   - If user asks for an alignment, **CHAIN YOUR TOOLS**.
-
-2. **LANGUAGE MIRRORING ENFORCEMENT:**
-   - Focus ONLY on the CURRENT message.
-
-INTERACTION RULES:
-- **Tools:** ALWAYS check if a specialist is needed.
-- **Conciseness:** Keep responses under 1200 chars.
-- **Deletion Rule:** If user asks to delete/undo, you MUST call `delete_specific_transaction`.
-- **Coach Rule:** If a new Project is created, call `log_habit` with 'New Project Started'.
-- **AUTO-SAVE PROTOCOL:**
-    - Save new habits automatically with `log_habit`.
-    - Save study plans automatically with `save_smart_note`.
-- **IMMEDIATE ACTION PROTOCOL:**
-    - Schedule new habits immediately with `add_to_inbox`.
-    - Schedule first steps of study plans with `add_to_inbox`.
-- **PLANNING BEHAVIOR:**
-    - If user says 'Plan my week', call `generate_weekly_sprint`.
-
-CONTEXT & RULES:
-- **Currency:** Default 'COP'. Use 'USD' only if asked.
-- **Finance Types:** ['EXPENSE', 'INCOME', 'DEBT_PAYMENT', 'INVESTMENT', 'NEW_DEBT'].
-- **Librarian Rule:** Use `research_topic` for learning, `save_smart_note` for thoughts.
-
-CORE MEMORY:
-- READ 'User Profile' to know the user.
-- WRITE to it using `remember_fact`.
-
-WORKFLOWS:
-- **STRATEGIC ALIGNMENT:** `read_file` -> `analyze_project_for_habits` -> `create_study_plan` -> `get_financial_advice` -> Summarize.
-- **MORNING ROUTINE:** `generate_morning_briefing`.
-"""
-
-        self.base_system_instruction = system_instruction
-
-        self.model = genai.GenerativeModel(
-            model_name=settings.GEMINI_MODEL,
-            safety_settings=safety_settings,
-            system_instruction=system_instruction,
-            tools=list(self.available_tools.values())
-        )
+        self.base_system_instruction = SYSTEM_INSTRUCTION
+        self.safety_settings = safety_settings
+        # Static declarations; available_tools stays the runtime dispatch table
+        self.tools = [protos.Tool(function_declarations=_TOOL_DECLS)]
+        undeclared = self.available_tools.keys() ^ {decl.name for decl in _TOOL_DECLS}
+        if undeclared:
+            logger.warning(f"Tools out of sync with tools.json: {sorted(undeclared)}")
+
+        # Context cache state: rebuilt when it nears expiry or the user profile changes
+        self._context_cache = None
+        self._context_cache_expires = 0.0
+        self._context_cache_dirty = False
+        # Serializes rebuilds, so concurrent turns don't each create a CachedContent
+        self._context_cache_lock = asyncio.Lock()
+        self._cache_cleanups: set[asyncio.Task] = set()
+        self.model = self._build_model()
         # Utility model for cleaning structured files
-        self.profile_model = genai.GenerativeModel(
-            model_name=settings.GEMINI_MODEL,
-            system_instruction="You maintain a concise, well-structured user profile."
-        )
+        self.profile_model = get_model(settings.GEMINI_MODEL, "You maintain a concise, well-structured user profile.")
         
-        self.sessions = {}
+        # sender -> (ChatSession, last_seen), least recently used first
+        self.sessions: OrderedDict[str, tuple[genai.ChatSession, float]] = OrderedDict()
+        # sender -> lock serializing that sender's turns (see process_message)
+        self._sender_locks: dict[str, asyncio.Lock] = {}
+        # Max tool calls from a single model turn executed at the same time
+        self.tool_concurrency_limit = 4
+
+        # sha256(media URL) -> (expires_at, upload task), see _get_gemini_file
+        self._media_cache: dict[str, tuple[float, asyncio.Future]] = {}
+
+        # Event loop serving process_message, for sync tools that bridge to async code
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+        # remember_fact buffer, merged into UserProfile.md by flush_profile
+        self._profile_buffer: list[str] = []
+        self._profile_lock = threading.Lock()
+        # Held across a whole flush (read -> merge -> write), so the periodic, shutdown
+        # and atexit flushes can't overwrite each other's merged facts
+        self._profile_flush_lock = threading.Lock()
+        atexit.register(self.flush_profile)
+
+        # Vault file index for read_file: [(lowercased name, Path)], rebuilt when a vault dir changes
+        self._vault_index: list[tuple[str, Path]] = []
+        self._vault_dir_mtimes: dict[str, float] = {}
+
+    def _build_model(self) -> genai.GenerativeModel:
+        """
+        Builds the chat model on top of a Gemini context cache holding the system
+        instruction, tool declarations and user profile, so each turn doesn't re-send them.
+        Falls back to a plain model if the cache can't be created (e.g. the prompt is
+        below the model's minimum cacheable size or the API is unavailable).
+        """
+        try:
+            self._context_cache = caching.CachedContent.create(
+                model=settings.GEMINI_MODEL,
+                display_name="orchestrator-context",
+                system_instruction=self.base_system_instruction,
+                tools=self.tools,
+                contents=[{"role": "user", "parts": [f"USER PROFILE:\n{self._load_user_profile()}"]}],
+                ttl=CONTEXT_CACHE_TTL,
+            )
+            self._context_cache_expires = time.time() + CONTEXT_CACHE_TTL.total_seconds()
+            return genai.GenerativeModel.from_cached_content(
+                self._context_cache, safety_settings=self.safety_settings
+            )
+        except Exception as e:
+            logger.warning(f"Context cache unavailable, using uncached model: {e}")
+            self._context_cache = None
+            return genai.GenerativeModel(
+                model_name=settings.GEMINI_MODEL,
+                safety_settings=self.safety_settings,
+                system_instruction=self.base_system_instruction,
+                tools=self.tools
+            )
+
+    def _context_cache_stale(self) -> bool:
+        if self._context_cache_dirty:
+            return True
+        if self._context_cache is None:
+            return False
+        return time.time() > self._context_cache_expires - CONTEXT_CACHE_REFRESH_MARGIN
+
+    async def _ensure_model(self):
+        """Rebuilds the cached model if the profile changed or the cache is about to expire."""
+        if not self._context_cache_stale():
+            return
+        async with self._context_cache_lock:
+            if not self._context_cache_stale(): # Rebuilt by a concurrent turn
+                return
+            self._context_cache_dirty = False
+            old_cache = self._context_cache
+            self.model = await _run_blocking(self._build_model)
+        if old_cache is not None and old_cache is not self._context_cache:
+            # In-flight turns still use the old cache: delete it after a grace period
+            task = asyncio.create_task(self._delete_context_cache(old_cache))
+            self._cache_cleanups.add(task)
+            task.add_done_callback(self._cache_cleanups.discard)
+
+    async def _delete_context_cache(self, cache: caching.CachedContent):
+        """Deletes a superseded context cache so it isn't billed until it expires."""
+        await asyncio.sleep(CONTEXT_CACHE_GRACE)
+        try:
+            await _run_blocking(cache.delete)
+        except Exception as e:
+            logger.warning(f"Could not delete superseded context cache: {e}")
 
+    def _get_session(self, sender: str) -> genai.ChatSession | None:
+        """Returns the sender's chat (refreshing its LRU position), or None if absent/expired."""
+        entry = self.sessions.get(sender)
+        if entry is None:
+            return None
+        chat, last_seen = entry
+        now = time.time()
+        if now - last_seen > settings.SESSION_TTL:
+            del self.sessions[sender]
+            return None
+        self.sessions[sender] = (chat, now)
+        self.sessions.move_to_end(sender)
+        return chat
+
+    def _store_session(self, sender: str, chat: genai.ChatSession):
+        self.sessions[sender] = (chat, time.time())
+        self.sessions.move_to_end(sender)
+        self._evict_sessions()
+
+    def _evict_sessions(self):
+        """Drops least recently used sessions over MAX_SESSIONS and any idle longer than SESSION_TTL."""
+        cutoff = time.time() - settings.SESSION_TTL
+        while self.sessions:
+            _, last_seen = next(iter(self.sessions.values()))
+            if len(self.sessions) <= settings.MAX_SESSIONS and last_seen >= cutoff:
+                break
+            sender, _ = self.sessions.popitem(last=False)
+            lock = self._sender_locks.get(sender)
+            if lock is not None and not lock.locked():
+                del self._sender_locks[sender]
+            logger.info(f"🧹 Evicted session for {sender}")
+
+    def _save_session(self, sender: str, history_json: str):
+        """Atomically writes a serialized chat history to vault/.sessions."""
+        path = _session_path(sender)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text(history_json, encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not persist session for {sender}: {e}")
+
+    def _restore_session(self, sender: str) -> genai.ChatSession | None:
+        """Rebuilds a chat from its persisted history, unless missing or idle longer than SESSION_TTL."""
+        path = _session_path(sender)
+        try:
+            if time.time() - path.stat().st_mtime > settings.SESSION_TTL:
+                return None
+            history = json.loads(path.read_text(encoding="utf-8"))
+            return self.model.start_chat(history=[protos.Content(content) for content in history])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not restore session for {sender}: {e}")
+            return None
+
+    async def sweep_sessions(self, interval: int = 300):
+        """Background task: periodically evicts idle sessions even when no new ones arrive."""
+        while True:
+            await asyncio.sleep(interval)
+            self._evict_sessions()
+
+    @memoize_pure(ttl=300, invalidate_on=("vault/Internal/SystemConfig.md",))
     def _get_system_config(self) -> str:
         """Reads vault/Internal/SystemConfig.md to find Assistant Name."""
         try:
             config_path = Path("vault/Internal/SystemConfig.md")
             if config_path.exists():
-                content = config_path.read_text(encoding="utf-8")
-                for line in content.splitlines():
-                    if line.startswith("Assistant Name:"):
-                        return line.split(":", 1)[1].strip()
+                match = _NAME_RE.search(config_path.read_text(encoding="utf-8"))
+                return match.group(1).strip() if match else None
             return None
         except Exception:
             return None
@@ -165,12 +367,14 @@ WORKFLOWS:
             
             content = f"# System Configuration\nAssistant Name: {name}\nUpdated: {datetime.now()}"
             config_path.write_text(content, encoding="utf-8")
+            self._vault_dir_mtimes = {} # Invalidate vault index
             
             return f"Identity established: I am {name}."
         except Exception as e:
             logger.error(f"Error setting name: {e}")
             return f"Failed to set name: {e}"
 
+    @memoize_pure(ttl=300, invalidate_on=("vault/Internal/UserProfile.md",))
     def _load_user_profile(self) -> str:
         """Reads the content of vault/Internal/UserProfile.md"""
         try:
@@ -186,8 +390,25 @@ WORKFLOWS:
         """
         Maintains a smart, structured User Profile by merging new facts.
         """
+        # Facts are merged into the profile in batches by flush_profile
+        with self._profile_lock:
+            self._profile_buffer.append(fact)
+        return "Memory updated."
+
+    @locked("_profile_flush_lock")
+    def flush_profile(self):
+        """
+        Merges all buffered facts into vault/Internal/UserProfile.md with a single
+        LLM call and a single write. Called periodically, on shutdown and at exit.
+        """
+        with self._profile_lock:
+            facts, self._profile_buffer = self._profile_buffer, []
+        if not facts:
+            return
+
+        profile_path = Path("vault/Internal/UserProfile.md")
+        new_facts = "\n".join(f'- "{fact}"' for fact in facts)
         try:
-            profile_path = Path("vault/Internal/UserProfile.md")
             profile_path.parent.mkdir(parents=True, exist_ok=True)
 
             existing_profile = ""
@@ -210,9 +431,10 @@ WORKFLOWS:
 Current Profile:
 {existing_profile}
 
-New Fact: "{fact}"
+New Facts:
+{new_facts}
 
-TASK: Merge this new fact into the profile. Return UPDATED markdown grouped as:
+TASK: Merge these new facts into the profile. Return UPDATED markdown grouped as:
 ## Identity
 - ...
 ## Goals
@@ -225,28 +447,75 @@ Keep it concise and bullet-based.
             cleaned_profile = response.text.strip() if response and response.text else ""
 
             if not cleaned_profile:
-                cleaned_profile = existing_profile + f"\n- {fact}"
+                cleaned_profile = existing_profile + "".join(f"\n- {fact}" for fact in facts)
 
             profile_path.write_text(cleaned_profile.strip() + "\n", encoding="utf-8")
-            return "Memory updated."
+            logger.info(f"🧠 Merged {len(facts)} fact(s) into the user profile")
         except Exception as e:
             logger.error(f"Error updating user profile: {e}")
             # Basic fallback append
             with open(profile_path, "a", encoding="utf-8") as f:
-                f.write(f"\n- {fact}")
-            return "Memory updated (fallback)."
+                f.write("".join(f"\n- {fact}" for fact in facts))
+        self._vault_dir_mtimes = {} # Invalidate vault index
+        self._context_cache_dirty = True # Profile is part of the cached context
 
+    async def flush_profile_periodically(self, interval: int = 30):
+        """Background task: flushes buffered profile facts every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            await _run_blocking(self.flush_profile)
+
+    def _refresh_vault_index(self):
+        """
+        Rebuilds the vault .md index with os.scandir, but only if a vault directory changed.
+        A directory's mtime changes whenever entries are added, removed or renamed in it,
+        so checking the (few) directories replaces stat-ing every file on each lookup.
+        Hidden and app-state directories (sessions, LLM cache) are not walked.
+        """
+        if self._vault_dir_mtimes:
+            try:
+                if all(os.stat(d).st_mtime == mtime for d, mtime in self._vault_dir_mtimes.items()):
+                    return
+            except FileNotFoundError:
+                pass
+
+        index = []
+        dir_mtimes = {}
+        stack = ["vault"]
+        while stack:
+            dir_path = stack.pop()
+            try:
+                dir_mtimes[dir_path] = os.stat(dir_path).st_mtime
+                with os.scandir(dir_path) as entries:
+                    for entry in entries:
+                        if entry.name.startswith(".") or entry.path in _NON_NOTE_DIRS:
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith(".md") and entry.is_file():
+                            index.append((entry.name.lower(), Path(entry.path)))
+            except FileNotFoundError:
+                continue
+
+        self._vault_index = index
+        self._vault_dir_mtimes = dir_mtimes
+
+    @memoize_pure(ttl=60)
     def read_any_vault_file(self, path_fragment: str) -> str:
         """
         Searches recursively in vault/ for a file matching the fragment and returns its text.
         """
         try:
-            vault_root = Path("vault")
-            for file_path in vault_root.rglob("*"):
-                if file_path.is_file() and file_path.suffix == ".md":
-                    if path_fragment.lower() in file_path.name.lower():
-                        logger.info(f"Reading file: {file_path}")
-                        return file_path.read_text(encoding="utf-8")
+            self._refresh_vault_index()
+            fragment = path_fragment.lower()
+            for name, file_path in self._vault_index:
+                if fragment in name:
+                    logger.info(f"Reading file: {file_path}")
+                    depends_on(file_path)
+                    return file_path.read_text(encoding="utf-8")
+            # Re-check once a matching file is added anywhere in the vault
+            for dir_path in self._vault_dir_mtimes:
+                depends_on(dir_path)
             return f"File matching '{path_fragment}' not found in Vault."
         except Exception as e:
             logger.error(f"Error reading vault file: {e}")
@@ -256,10 +525,19 @@ Keep it concise and bullet-based.
         """
         Generates a comprehensive morning briefing (Tasks + Finance + Motivation).
         """
+        # Tools run in worker threads: hand the coroutine to the app's event loop
+        if self._loop is not None and self._loop.is_running():
+            return asyncio.run_coroutine_threadsafe(self.generate_morning_briefing_async(), self._loop).result()
+        return asyncio.run(self.generate_morning_briefing_async())
+
+    async def generate_morning_briefing_async(self) -> str:
+        """Async variant of generate_morning_briefing. The three sections are built concurrently."""
         try:
-            inbox_summary = self.projects.review_inbox()
-            finance_summary = self.finance.perform_audit(scope="daily_quick_check")
-            motivation = self.goals.morning_briefing()
+            inbox_summary, finance_summary, motivation = await asyncio.gather(
+                asyncio.to_thread(self.projects.review_inbox),
+                self.finance.perform_audit_async(scope="daily_quick_check"),
+                self.goals.morning_briefing_async()
+            )
             
             combined_report = f"""
 # 🌅 MORNING BRIEFING
@@ -278,11 +556,148 @@ Keep it concise and bullet-based.
             logger.error(f"Error generating morning briefing: {e}")
             return f"Failed to generate briefing: {e}"
 
-    async def process_message(self, message: str, sender: str, media_url: str = None, media_type: str = None):
+    async def _run_tools(self, calls: list) -> list:
+        """
+        Executes a turn's function calls in the order the model emitted them.
+        Runs of consecutive read-only (_PURE_TOOLS) calls execute concurrently (bounded);
+        every other tool writes to the vault and runs alone, one after another.
+        """
+        semaphore = asyncio.Semaphore(self.tool_concurrency_limit)
+        results = []
+        pure_batch = []
+        for fc in calls:
+            if fc.name in _PURE_TOOLS:
+                pure_batch.append(fc)
+                continue
+            if pure_batch:
+                results.extend(await asyncio.gather(*(self._run_tool(c, semaphore) for c in pure_batch)))
+                pure_batch = []
+            results.append(await self._run_tool(fc, semaphore))
+        if pure_batch:
+            results.extend(await asyncio.gather(*(self._run_tool(c, semaphore) for c in pure_batch)))
+        return results
+
+    async def _run_tool(self, fc, semaphore: asyncio.Semaphore):
+        """Executes one Gemini function call on the Gemini thread pool and returns its result."""
+        tool_name = fc.name
+        args = _to_pyargs(fc.args)
+        
+        logger.info("🔧 Gemini calling: %s with %s", tool_name, args)
+
+        handler = self._tools_by_name.get(tool_name)
+        if handler is None:
+            tool_result = f"Error: Tool {tool_name} not found."
+        else:
+            try:
+                async with semaphore:
+                    tool_result = await _run_blocking(handler, **args)
+            except Exception as e:
+                tool_result = f"Error executing tool: {str(e)}"
+            if tool_name not in _PURE_TOOLS:
+                bump()
+        
+        logger.info("⚙️ Output: %s", tool_result)
+        return tool_result
+
+    async def _download_media(self, client: httpx.AsyncClient, media_url: str, auth, dest: Path) -> bool:
+        """
+        Streams media to `dest` in 64 KB chunks, so memory stays flat regardless of file size.
+        Returns False on a non-200 response; raises if the body exceeds MAX_MEDIA_BYTES.
+        """
+        async with client.stream("GET", media_url, auth=auth) as r:
+            if r.status_code != 200:
+                return False
+            if int(r.headers.get("content-length", 0)) > settings.MAX_MEDIA_BYTES:
+                raise ValueError(f"Media larger than {settings.MAX_MEDIA_BYTES} bytes")
+
+            received = 0
+            with open(dest, "wb") as f:
+                async for chunk in r.aiter_bytes(65536):
+                    received += len(chunk)
+                    if received > settings.MAX_MEDIA_BYTES:
+                        raise ValueError(f"Media larger than {settings.MAX_MEDIA_BYTES} bytes")
+                    await asyncio.to_thread(f.write, chunk)
+        return True
+
+    async def _upload_media(self, media_url: str, media_type: str, http_client: httpx.AsyncClient = None):
+        """Downloads Twilio media and uploads it to Gemini. Returns None if the download failed."""
+        auth = (settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN) if settings.TWILIO_ACCOUNT_SID and settings.TWILIO_AUTH_TOKEN else None
+        ext = ".ogg"
+        if media_type:
+            if "image" in media_type: ext = ".jpg"
+            elif "audio" in media_type: ext = ".ogg"
+
+        # System temp dir (usually tmpfs) instead of the CWD; removed even if upload fails
+        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tf:
+            temp_file_path = Path(tf.name)
+        try:
+            if http_client is not None:
+                downloaded = await self._download_media(http_client, media_url, auth, temp_file_path)
+            else:
+                # Twilio media URLs redirect to the actual file storage
+                async with httpx.AsyncClient(follow_redirects=True) as client:
+                    downloaded = await self._download_media(client, media_url, auth, temp_file_path)
+            if not downloaded:
+                return None
+
+            return await _run_blocking(genai.upload_file, path=temp_file_path)
+        finally:
+            temp_file_path.unlink(missing_ok=True)
+
+    async def _get_gemini_file(self, media_url: str, media_type: str, http_client: httpx.AsyncClient = None):
+        """
+        Single-flight wrapper around _upload_media: the same media URL (Twilio webhook
+        retries, re-sent messages) is downloaded and uploaded once, concurrent requests
+        share the in-flight upload, and the result is reused while Gemini keeps the file.
+        """
+        key = hashlib.sha256(media_url.encode("utf-8")).hexdigest()
+        now = time.time()
+        entry = self._media_cache.get(key)
+        if entry is None or entry[0] <= now:
+            # Drop expired uploads before adding a new one
+            for stale_key in [k for k, (expires, _) in self._media_cache.items() if expires <= now]:
+                del self._media_cache[stale_key]
+            entry = (now + MEDIA_CACHE_TTL, asyncio.ensure_future(self._upload_media(media_url, media_type, http_client)))
+            self._media_cache[key] = entry
+
+        task = entry[1]
+        try:
+            # Shielded so one cancelled request doesn't cancel the upload others are waiting on
+            gemini_file = await asyncio.shield(task)
+        except Exception:
+            if self._media_cache.get(key) is entry:
+                del self._media_cache[key]
+            raise
+        if gemini_file is None and self._media_cache.get(key) is entry:
+            del self._media_cache[key]
+        return gemini_file
+
+    async def process_message(self, message: str, sender: str, media_url: str = None, media_type: str = None,
+                              http_client: httpx.AsyncClient = None):
+        """
+        Runs one user turn. Turns from the same sender are serialized: a ChatSession
+        can't take a second send_message_async while one is in flight (history would
+        interleave), so the lock is held from session lookup until the history is saved.
+        """
+        lock = self._sender_locks.setdefault(sender, asyncio.Lock())
+        async with lock:
+            return await self._process_turn(message, sender, media_url, media_type, http_client)
+
+    async def _process_turn(self, message: str, sender: str, media_url: str, media_type: str,
+                            http_client: httpx.AsyncClient):
+        self._loop = asyncio.get_running_loop()
         assistant_name = self._get_system_config()
 
+        await self._ensure_model()
+
         # 1. Session Init
-        if sender not in self.sessions:
+        chat = self._get_session(sender)
+        if chat is None:
+            chat = await asyncio.to_thread(self._restore_session, sender)
+            if chat is not None:
+                logger.info(f"♻️ Restored session for {sender}")
+                self._store_session(sender, chat)
+        if chat is None:
             logger.info(f"🆕 Starting new session for {sender}")
 
             if not assistant_name:
@@ -304,82 +719,52 @@ Keep it concise and bullet-based.
                 {"role": "user", "parts": [intro_msg]},
                 {"role": "model", "parts": ["Understood. I will adapt to this state."]}
             ]
-            self.sessions[sender] = self.model.start_chat(history=history)
-        
-        chat = self.sessions[sender]
+            chat = self.model.start_chat(history=history)
+            self._store_session(sender, chat)
+
+        if chat.model is not self.model:
+            chat.model = self.model # Re-bind to the refreshed context cache
 
         # 2. Content
         content = message
         if media_url:
             logger.info(f"Processing media: {media_url}")
             try:
-                auth = (settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN) if settings.TWILIO_ACCOUNT_SID and settings.TWILIO_AUTH_TOKEN else None
-                r = requests.get(media_url, auth=auth)
-                
-                if r.status_code == 200:
-                    ext = ".ogg"
-                    if media_type:
-                        if "image" in media_type: ext = ".jpg"
-                        elif "audio" in media_type: ext = ".ogg"
-
-                    temp_file_path = Path(f"temp_{uuid.uuid4()}{ext}")
-                    
-                    with open(temp_file_path, 'wb') as f:
-                        f.write(r.content)
-                    
-                    gemini_file = genai.upload_file(path=temp_file_path)
-                    content = ["Listen to this audio/view this image and act accordingly.", gemini_file]
-                    
-                    if temp_file_path.exists():
-                         os.remove(temp_file_path)
-                else:
+                gemini_file = await self._get_gemini_file(media_url, media_type, http_client)
+                if gemini_file is None:
                     return "Error downloading media."
+
+                content = ["Listen to this audio/view this image and act accordingly.", gemini_file]
             except Exception as e:
                 logger.error(f"Media error: {e}")
                 return "Error procesando media."
 
         # 3. First Send
         logger.info(f"Sending to Gemini (Session: {sender})...")
-        response = chat.send_message(content)
+        response = await chat.send_message_async(content)
 
         # 4. ReAct Loop
         try:
             while True:
                 candidate = response.candidates[0]
                 logger.info(f"🔍 Raw Candidate: {candidate}")
-                function_call_part = None
-                for part in candidate.content.parts:
-                    if part.function_call:
-                        function_call_part = part
-                        break
+                calls = [part.function_call for part in candidate.content.parts if part.function_call]
                 
-                if not function_call_part:
+                if not calls:
                     break
                 
-                fc = function_call_part.function_call
-                tool_name = fc.name
-                args = dict(fc.args)
-                
-                logger.info(f"🔧 Gemini calling: {tool_name} with {args}")
-
-                if tool_name in self.available_tools:
-                    try:
-                        tool_result = self.available_tools[tool_name](**args)
-                    except Exception as e:
-                        tool_result = f"Error executing tool: {str(e)}"
-                else:
-                    tool_result = f"Error: Tool {tool_name} not found."
-                
-                logger.info(f"⚙️ Output: {tool_result}")
+                # All results go back to Gemini in a single message
+                results = await self._run_tools(calls)
 
-                response = chat.send_message(
+                response = await chat.send_message_async([
                     protos.Part(
                         function_response=protos.FunctionResponse(
-                            name=tool_name,
+                            name=fc.name,
                             response={'result': tool_result}
                         )
                     )
-                )
+                    for fc, tool_result in zip(calls, results)
+                ])
 
             # 5. SAFE TEXT EXTRACTION & FORCED REPLY
             final_text_parts = []
@@ -391,11 +776,13 @@ Keep it concise and bullet-based.
             
             if not final_response:
                 logger.info("⚠️ Response empty after tools. Forcing a text reply...")
-                fallback_response = chat.send_message(
+                fallback_response = await chat.send_message_async(
                     "System Note: Tool execution successful. Now confirm this to the user in their language. Be brief."
                 )
-                return fallback_response.text
-                
+                final_response = fallback_response.text
+
+            # Serialized here (history is mutated on this loop), written in a worker thread
+            await asyncio.to_thread(self._save_session, sender, _serialize_history(chat))
             return final_response
 
         except Exception as e:
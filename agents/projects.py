@@ -1,12 +1,11 @@
 import os
 from pathlib import Path
-import google.generativeai as genai
 from config import settings
+from agents._models import get_model
+from agents._memo import depends_on, memoize_pure
 import logging
 from datetime import datetime
 
-# Configure Logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class ProjectsAgent:
@@ -33,10 +32,7 @@ class ProjectsAgent:
         - **Milestones** (formatted as `### 🚩 Milestone: Name`)
         """
         
-        self.model = genai.GenerativeModel(
-            model_name=settings.GEMINI_MODEL,
-            system_instruction=self.pm_system_instruction
-        )
+        self.model = get_model(settings.GEMINI_MODEL, self.pm_system_instruction)
 
     def add_to_inbox(self, task: str, tag: str = None) -> str:
         """
@@ -125,6 +121,7 @@ objective: {objective}
             logger.error(f"Error creating project plan: {e}")
             return f"Failed to create project plan: {e}"
 
+    @memoize_pure(ttl=60, invalidate_on=("vault/Inbox.md",))
     def review_inbox(self) -> str:
         """
         The Audit: Reviews the Inbox and summarizes pending tasks.
@@ -150,14 +147,17 @@ objective: {objective}
             logger.error(f"Error reviewing inbox: {e}")
             return f"Failed to review inbox: {e}"
 
+    @memoize_pure(ttl=60)
     def get_project_plan(self, project_name: str) -> str:
         """
         Reads the content of a specific project plan.
         """
         try:
-            # Case-insensitive search for project file
+            # Case-insensitive search for project file (re-checked when projects are added/removed)
+            depends_on(self.projects_path)
             for file_path in self.projects_path.glob("*.md"):
                 if project_name.lower() in file_path.name.lower():
+                    depends_on(file_path)
                     return file_path.read_text(encoding="utf-8")
             
             return "Project plan not found."
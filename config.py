@@ -1,4 +1,5 @@
 import os
+import logging
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -6,8 +7,26 @@ class Settings(BaseSettings):
     TWILIO_ACCOUNT_SID: str = ""
     TWILIO_AUTH_TOKEN: str = ""
     GEMINI_MODEL: str = "gemini-2.5-flash"
+    # Model for non-interactive work (audits, briefings, research). Empty = GEMINI_MODEL
+    GEMINI_BACKGROUND_MODEL: str = ""
+    LOG_LEVEL: str = "INFO"
+    # In-memory chat sessions: max kept, and idle seconds before eviction
+    MAX_SESSIONS: int = 200
+    SESSION_TTL: int = 6 * 3600
+    # Largest WhatsApp media attachment downloaded for Gemini (bytes)
+    MAX_MEDIA_BYTES: int = 25 * 1024 * 1024
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
+    @property
+    def background_model(self) -> str:
+        return self.GEMINI_BACKGROUND_MODEL or self.GEMINI_MODEL
+
 settings = Settings()
 
+def setup_logging():
+    """Configures root logging once at app startup. Agent modules only call getLogger."""
+    logging.basicConfig(
+        level=settings.LOG_LEVEL.upper(),
+        format="%(asctime)s %(name)s %(levelname)s %(message)s"
+    )
@@ -1,18 +1,24 @@
 import os
-import textwrap
+import asyncio
+import bisect
+import itertools
+import functools
 import logging
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from fastapi import FastAPI, Form, Depends
+from fastapi import FastAPI, Form, Depends, Request, BackgroundTasks
 from fastapi.responses import Response, PlainTextResponse
 from typing import Optional
 from pydantic import BaseModel
 import google.generativeai as genai
+from google.api_core.retry import AsyncRetry
 from twilio.rest import Client
-from config import settings
+from config import settings, setup_logging
 from agents.orchestrator import OrchestratorAgent
 
-# Configure Logging
-logging.basicConfig(level=logging.INFO)
+# Configure Logging (once, for the whole app)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI
@@ -57,11 +63,87 @@ genai.configure(api_key=settings.GOOGLE_API_KEY)
 
 # Initialize Twilio Client
 twilio_client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+# Blocking Twilio sends run on their own pool, separate from Gemini and file I/O work
+twilio_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="twilio")
 
 # Initialize Orchestrator (AI Assistant)
 # We initialize it here so it persists across requests (simple in-memory for now)
 orchestrator = OrchestratorAgent()
 
+@app.on_event("startup")
+async def start_background_tasks():
+    """Starts periodic housekeeping that runs for the lifetime of the app."""
+    # One pooled client for media downloads, so keep-alive connections are reused
+    app.state.http = httpx.AsyncClient(
+        timeout=30,
+        follow_redirects=True, # Twilio media URLs redirect to the actual file storage
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+    )
+    app.state.session_sweeper = asyncio.create_task(orchestrator.sweep_sessions())
+    app.state.profile_flusher = asyncio.create_task(orchestrator.flush_profile_periodically())
+
+@app.on_event("startup")
+async def warmup():
+    """
+    Opens the Gemini and Twilio connections (DNS + TLS) before the first webhook,
+    so the first user doesn't pay for them. Failures only log a warning.
+    """
+    try:
+        # Chat turns go through the SDK's shared async generative client, so warm that
+        # channel with a (free) token count rather than the separate model-service client.
+        # Bounded retry so an unreachable API can't stall startup for the default 60s.
+        await genai.GenerativeModel(settings.GEMINI_MODEL).count_tokens_async(
+            "ping", request_options={"timeout": 10, "retry": AsyncRetry(timeout=10)}
+        )
+    except Exception as e:
+        logger.warning(f"Gemini warmup failed: {e}")
+    try:
+        # Media URLs live on api.twilio.com; any response leaves a pooled connection
+        await app.state.http.head("https://api.twilio.com", timeout=5)
+    except Exception as e:
+        logger.warning(f"Twilio warmup failed: {e}")
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    app.state.session_sweeper.cancel()
+    app.state.profile_flusher.cancel()
+    await asyncio.to_thread(orchestrator.flush_profile)
+    await asyncio.to_thread(orchestrator.knowledge.save_index)
+    await app.state.http.aclose()
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    return request.app.state.http
+
+def iter_utf8_chunks(text: str, max_bytes: int = 1500):
+    """
+    Yields pieces of `text` of at most `max_bytes` UTF-8 bytes (WhatsApp caps a
+    message at 1600), splitting at the last whitespace that fits, or mid-word if
+    no whitespace leaves the piece at least half full.
+    """
+    text = text.strip()
+    if len(text.encode("utf-8")) <= max_bytes:
+        if text:
+            yield text
+        return
+
+    # offsets[i] = UTF-8 size of text[:i], so any cut's byte cost is one subtraction
+    offsets = [0, *itertools.accumulate(len(ch.encode("utf-8")) for ch in text)]
+    start = 0
+    while start < len(text):
+        # Longest prefix of text[start:] that fits the budget
+        end = bisect.bisect_right(offsets, offsets[start] + max_bytes) - 1
+        if end < len(text):
+            split_at = max(text.rfind(" ", start, end), text.rfind("\n", start, end))
+            # Only split at whitespace if that doesn't leave a near-empty piece
+            if split_at > start and offsets[split_at] - offsets[start] >= max_bytes // 2:
+                end = split_at
+        piece = text[start:end].strip()
+        if piece:
+            yield piece
+        start = end
+        while start < len(text) and text[start].isspace():
+            start += 1
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -71,51 +153,73 @@ async def health_check():
         "agent": "AI Assistant Online"
     }
 
+async def _handle_message(
+    user_text: str,
+    sender: str,
+    to: str,
+    media_url: Optional[str],
+    media_type: Optional[str],
+    http_client: httpx.AsyncClient
+):
+    """
+    Runs the orchestrator for one incoming message and sends the reply via the Twilio API.
+    Scheduled as a background task so the webhook can answer Twilio immediately.
+    """
+    try:
+        # Pass 'From' as the sender identifier for session management
+        response_text = await orchestrator.process_message(
+            message=user_text,
+            sender=sender,
+            media_url=media_url,
+            media_type=media_type,
+            http_client=http_client
+        )
+    except Exception as e:
+        logger.error(f"🔥 Error processing message from {sender}: {e}", exc_info=True)
+        return
+
+    # Sent one after another (off the event loop) so WhatsApp shows chunks in order
+    for chunk in iter_utf8_chunks(response_text):
+        try:
+            message = await asyncio.get_running_loop().run_in_executor(
+                twilio_executor,
+                functools.partial(
+                    twilio_client.messages.create,
+                    from_=to,    # The Sandbox Number (received in request)
+                    to=sender,   # The User's Number
+                    body=chunk
+                )
+            )
+            logger.info(f"📤 Sent Message SID: {message.sid}")
+        except Exception as e:
+            logger.error(f"❌ Error sending message: {e}")
+
 @app.post("/bot")
 async def bot_webhook(
+    background_tasks: BackgroundTasks,
     From: str = Form(...),
     To: str = Form(...), # The Twilio Sandbox Number
     Body: str = Form(None), # Body can be empty if it's just media
     MediaUrl0: Optional[str] = Form(None),
-    MediaContentType0: Optional[str] = Form(None)
+    MediaContentType0: Optional[str] = Form(None),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     Twilio Webhook Endpoint.
     Receives 'From' (User's WhatsApp number), 'To' (Sandbox number), and 'Body'.
     Also handles MediaUrl0 (first attachment) if present.
-    Sends response directly via Twilio API.
+    Acknowledges right away; the reply is sent later via the Twilio API.
     """
     logger.info(f"Received message from {From} to {To}. Body: '{Body}', Media: {MediaUrl0}")
 
     # Delegate to Orchestrator
     # We pass None if Body is empty/None to ensure clarity, though process_message handles it.
     user_text = Body if Body else ""
-    
-    # Pass 'From' as the sender identifier for session management
-    response_text = await orchestrator.process_message(
-        message=user_text,
-        sender=From,
-        media_url=MediaUrl0,
-        media_type=MediaContentType0
-    )
 
-    # Chunk the message safely to avoid WhatsApp 1600 char limit
-    # Using 1200 to be safe with emojis and multi-byte chars
-    chunks = textwrap.wrap(response_text, width=1200, replace_whitespace=False)
-    
-    for chunk in chunks:
-        try:
-            message = twilio_client.messages.create(
-                from_=To,  # The Sandbox Number (received in request)
-                to=From,   # The User's Number
-                body=chunk
-            )
-            logger.info(f"📤 Sent Message SID: {message.sid}")
-        except Exception as e:
-            logger.error(f"❌ Error sending message: {e}")
+    background_tasks.add_task(_handle_message, user_text, From, To, MediaUrl0, MediaContentType0, http_client)
 
-    # Return simple OK as we've handled the response manually
-    return "OK"
+    # Return 200 before Gemini runs, so slow tool chains don't trip Twilio's webhook timeout
+    return Response(status_code=200)
 
 if __name__ == "__main__":
     import uvicorn